@@ -22,8 +22,18 @@
 #
 # Since this should not require frequent updates, we just store this
 # out-of-line and check the unicode.rs file into git.
-
-import fileinput, re, os, sys, operator
+#
+# The script only needs the standard library and runs under Python 2 or
+# Python 3. Its work is all plain integer loops, so running it under PyPy
+# speeds it up without changes.
+
+import re, os, sys, operator, bisect, heapq
+from collections import defaultdict
+from multiprocessing.pool import ThreadPool
+try:
+    from urllib.request import urlretrieve
+except ImportError:
+    from urllib import urlretrieve
 
 preamble = '''// Copyright 2012-2015 The Rust Project Developers. See the COPYRIGHT
 // file at the top-level directory of this distribution and at
@@ -57,103 +67,126 @@ expanded_categories = {
 # these are the surrogate codepoints, which are not valid rust characters
 surrogate_codepoints = (0xd800, 0xdfff)
 
+def download(f):
+    path = os.path.basename(f)
+    if not os.path.exists(path):
+        try:
+            urlretrieve("http://www.unicode.org/Public/UNIDATA/%s" % f, path)
+        except IOError:
+            # don't leave a partial file behind for the next run to trust
+            if os.path.exists(path):
+                os.remove(path)
+
 def fetch(f):
-    if not os.path.exists(os.path.basename(f)):
-        os.system("curl -O http://www.unicode.org/Public/UNIDATA/%s"
-                  % f)
+    download(f)
 
     if not os.path.exists(os.path.basename(f)):
         sys.stderr.write("cannot load %s" % f)
         exit(1)
 
+# read a whole data file at once, as a list of lines
+def load_lines(f):
+    fetch(f)
+    with open(os.path.basename(f), "rb") as fh:
+        return fh.read().decode("utf-8").splitlines()
+
 def is_surrogate(n):
     return surrogate_codepoints[0] <= n <= surrogate_codepoints[1]
 
 def load_unicode_data(f):
-    fetch(f)
-    gencats = {}
+    gencats = defaultdict(list)
     to_lower = {}
     to_upper = {}
     to_title = {}
-    combines = {}
+    combines = defaultdict(list)
     canon_decomp = {}
     compat_decomp = {}
 
-    udict = {};
     range_start = -1;
-    for line in fileinput.input(f):
+    for line in load_lines(f):
         data = line.split(';');
         if len(data) != 15:
             continue
         cp = int(data[0], 16);
         if is_surrogate(cp):
             continue
-        if range_start >= 0:
-            for i in xrange(range_start, cp):
-                udict[i] = data;
-            range_start = -1;
         if data[1].endswith(", First>"):
             range_start = cp;
             continue;
-        udict[cp] = data;
+        if range_start >= 0:
+            # the "Last>" line describes every code of the range it closes
+            codes = range(range_start, cp + 1)
+            range_start = -1;
+        else:
+            codes = (cp,)
 
-    for code in udict:
         [code_org, name, gencat, combine, bidi,
          decomp, deci, digit, num, mirror,
-         old, iso, upcase, lowcase, titlecase ] = udict[code];
+         old, iso, upcase, lowcase, titlecase ] = data;
+        cats = set([gencat, "Assigned"] + expanded_categories.get(gencat, []))
+
+        # decode the line's fields once, before expanding it to the codes
+        # it describes
 
         # generate char to char direct common and simple conversions
         # uppercase to lowercase
+        lower = None
         if lowcase != "" and code_org != lowcase:
-            to_lower[code] = (int(lowcase, 16), 0, 0)
+            lower = (int(lowcase, 16), 0, 0)
 
         # lowercase to uppercase
+        upper = None
         if upcase != "" and code_org != upcase:
-            to_upper[code] = (int(upcase, 16), 0, 0)
+            upper = (int(upcase, 16), 0, 0)
 
         # title case
+        title = None
         if titlecase.strip() != "" and code_org != titlecase:
-            to_title[code] = (int(titlecase, 16), 0, 0)
+            title = (int(titlecase, 16), 0, 0)
 
         # store decomposition, if given
+        decomp_map = None
         if decomp != "":
             if decomp.startswith('<'):
-                seq = []
-                for i in decomp.split()[1:]:
-                    seq.append(int(i, 16))
-                compat_decomp[code] = seq
+                decomp_map = compat_decomp
+                decomp = decomp.split()[1:]
             else:
-                seq = []
-                for i in decomp.split():
-                    seq.append(int(i, 16))
-                canon_decomp[code] = seq
-
-        # place letter in categories as appropriate
-        for cat in [gencat, "Assigned"] + expanded_categories.get(gencat, []):
-            if cat not in gencats:
-                gencats[cat] = []
-            gencats[cat].append(code)
-
-        # record combining class, if any
-        if combine != "0":
-            if combine not in combines:
-                combines[combine] = []
-            combines[combine].append(code)
+                decomp_map = canon_decomp
+                decomp = decomp.split()
+            seq = [int(i, 16) for i in decomp]
+
+        for code in codes:
+            if lower is not None:
+                to_lower[code] = lower
+            if upper is not None:
+                to_upper[code] = upper
+            if title is not None:
+                to_title[code] = title
+            if decomp_map is not None:
+                decomp_map[code] = list(seq)
+
+            # place letter in categories as appropriate
+            for cat in cats:
+                gencats[cat].append(code)
+
+            # record combining class, if any
+            if combine != "0":
+                combines[combine].append(code)
 
     # generate Not_Assigned from Assigned
     gencats["Cn"] = gen_unassigned(gencats["Assigned"])
     # Assigned is not a real category
     del(gencats["Assigned"])
     # Other contains Not_Assigned
-    gencats["C"].extend(gencats["Cn"])
-    gencats = group_cats(gencats)
-    combines = to_combines(group_cats(combines))
+    gencats["C"] = heapq.merge(gencats["C"], gencats["Cn"])
+    # UnicodeData.txt is in codepoint order, so every list is already sorted
+    gencats = group_cats(gencats, presorted=True)
+    combines = to_combines(group_cats(combines, presorted=True))
 
     return (canon_decomp, compat_decomp, gencats, combines, to_upper, to_lower, to_title)
 
 def load_special_casing(f, to_upper, to_lower, to_title):
-    fetch(f)
-    for line in fileinput.input(f):
+    for line in load_lines(f):
         data = line.split('#')[0].split(';')
         if len(data) == 5:
             code, lower, title, upper, _comment = data
@@ -176,40 +209,47 @@ def load_special_casing(f, to_upper, to_lower, to_title):
                 assert len(values) == 3
                 map_[key] = values
 
-def group_cats(cats):
+def group_cats(cats, presorted=False):
     cats_out = {}
     for cat in cats:
-        cats_out[cat] = group_cat(cats[cat])
+        cats_out[cat] = group_cat(cats[cat], presorted)
     return cats_out
 
-def group_cat(cat):
+def group_cat(cat, presorted=False):
     cat_out = []
-    letters = sorted(set(cat))
-    cur_start = letters.pop(0)
+    append = cat_out.append
+    if presorted:
+        letters = iter(cat)
+    else:
+        letters = iter(sorted(set(cat)))
+    cur_start = next(letters)
     cur_end = cur_start
     for letter in letters:
-        assert letter > cur_end, \
-            "cur_end: %s, letter: %s" % (hex(cur_end), hex(letter))
         if letter == cur_end + 1:
             cur_end = letter
-        else:
-            cat_out.append((cur_start, cur_end))
-            cur_start = cur_end = letter
-    cat_out.append((cur_start, cur_end))
+            continue
+        # only range breaks need checking; consecutive letters are in order
+        assert letter > cur_end, \
+            "cur_end: %s, letter: %s" % (hex(cur_end), hex(letter))
+        append((cur_start, cur_end))
+        cur_start = cur_end = letter
+    append((cur_start, cur_end))
     return cat_out
 
-def ungroup_cat(cat):
-    cat_out = []
-    for (lo, hi) in cat:
-        while lo <= hi:
-            cat_out.append(lo)
-            lo += 1
-    return cat_out
+# merge ranges, sorted by their start, that overlap or touch end to end
+def merge_ranges(ranges):
+    ranges_out = []
+    for (lo, hi) in ranges:
+        if ranges_out and lo <= ranges_out[-1][1] + 1:
+            ranges_out[-1] = (ranges_out[-1][0], max(ranges_out[-1][1], hi))
+        else:
+            ranges_out.append((lo, hi))
+    return ranges_out
 
 def gen_unassigned(assigned):
     assigned = set(assigned)
-    return ([i for i in range(0, 0xd800) if i not in assigned] +
-            [i for i in range(0xe000, 0x110000) if i not in assigned])
+    return (sorted(set(range(0, 0xd800)).difference(assigned)) +
+            sorted(set(range(0xe000, 0x110000)).difference(assigned)))
 
 def to_combines(combs):
     combs_out = []
@@ -220,6 +260,7 @@ def to_combines(combs):
     return combs_out
 
 def format_table_content(f, content, indent):
+    lines = []
     line = " "*indent
     first = True
     for chunk in content.split(","):
@@ -230,207 +271,355 @@ def format_table_content(f, content, indent):
                 line += ", " + chunk
             first = False
         else:
-            f.write(line + ",\n")
+            lines.append(line + ",\n")
             line = " "*indent + chunk
-    f.write(line)
+    lines.append(line)
+    f.write("".join(lines))
+
+# parse a "XXXX" or "XXXX..YYYY" codepoint field into an inclusive range
+def parse_range(field):
+    (lo, _, hi) = field.strip().partition('..')
+    lo = int(lo, 16)
+    if hi:
+        return (lo, int(hi, 16))
+    return (lo, lo)
 
 def load_properties(f, interestingprops):
-    fetch(f)
-    props = {}
-    re1 = re.compile("^ *([0-9A-F]+) *; *(\w+)")
-    re2 = re.compile("^ *([0-9A-F]+)\.\.([0-9A-F]+) *; *(\w+)")
-
-    for line in fileinput.input(os.path.basename(f)):
-        prop = None
-        d_lo = 0
-        d_hi = 0
-        m = re1.match(line)
-        if m:
-            d_lo = m.group(1)
-            d_hi = m.group(1)
-            prop = m.group(2)
-        else:
-            m = re2.match(line)
-            if m:
-                d_lo = m.group(1)
-                d_hi = m.group(2)
-                prop = m.group(3)
-            else:
-                continue
+    props = defaultdict(list)
+
+    for line in load_lines(f):
+        line = line.partition('#')[0].strip()
+        if not line:
+            continue
+        (cp, _, rest) = line.partition(';')
+        prop = rest.partition(';')[0].strip()
         if interestingprops and prop not in interestingprops:
             continue
-        d_lo = int(d_lo, 16)
-        d_hi = int(d_hi, 16)
-        if prop not in props:
-            props[prop] = []
+        (d_lo, d_hi) = parse_range(cp)
         props[prop].append((d_lo, d_hi))
 
     # optimize if possible
     for prop in props:
-        props[prop] = group_cat(ungroup_cat(props[prop]))
+        props[prop] = merge_ranges(sorted(props[prop]))
 
-    return props
+    return dict(props)
 
 # load all widths of want_widths, except those in except_cats
 def load_east_asian_width(want_widths, except_cats):
     f = "EastAsianWidth.txt"
-    fetch(f)
-    widths = {}
-    re1 = re.compile("^([0-9A-F]+);(\w+) +# (\w+)")
-    re2 = re.compile("^([0-9A-F]+)\.\.([0-9A-F]+);(\w+) +# (\w+)")
-
-    for line in fileinput.input(f):
-        width = None
-        d_lo = 0
-        d_hi = 0
-        cat = None
-        m = re1.match(line)
-        if m:
-            d_lo = m.group(1)
-            d_hi = m.group(1)
-            width = m.group(2)
-            cat = m.group(3)
-        else:
-            m = re2.match(line)
-            if m:
-                d_lo = m.group(1)
-                d_hi = m.group(2)
-                width = m.group(3)
-                cat = m.group(4)
-            else:
-                continue
+    widths = defaultdict(list)
+
+    for line in load_lines(f):
+        # the general category follows in the trailing comment
+        (line, _, comment) = line.partition('#')
+        line = line.strip()
+        comment = comment.split()
+        if not line or not comment:
+            continue
+        (cp, _, width) = line.partition(';')
+        width = width.strip()
+        cat = comment[0]
         if cat in except_cats or width not in want_widths:
             continue
-        d_lo = int(d_lo, 16)
-        d_hi = int(d_hi, 16)
-        if width not in widths:
-            widths[width] = []
+        (d_lo, d_hi) = parse_range(cp)
         widths[width].append((d_lo, d_hi))
-    return widths
+
+    # the file splits ranges wherever the general category changes
+    for width in widths:
+        widths[width] = merge_ranges(widths[width])
+
+    return dict(widths)
 
 def escape_char(c):
     return "'\\u{%x}'" % c if c != 0 else "'\\0'"
 
 def emit_bsearch_range_table(f):
     f.write("""
+use core::char;
+use core::option::Option::{self, Some, None};
+use core::slice::SliceExt;
+
+#[inline]
 fn bsearch_range_table(c: char, r: &'static [(char, char)]) -> bool {
-    use core::cmp::Ordering::{Equal, Less, Greater};
-    use core::slice::SliceExt;
-    r.binary_search_by(|&(lo, hi)| {
-         if lo <= c && c <= hi {
-             Equal
-         } else if hi < c {
-             Less
-         } else {
-             Greater
-         }
-     })
-     .is_ok()
+    // find the first range that does not end before c
+    let mut lo = 0;
+    let mut hi = r.len();
+    while lo < hi {
+        let m = lo + (hi - lo) / 2;
+        let before = r[m].1 < c;
+        lo = if before { m + 1 } else { lo };
+        hi = if before { hi } else { m };
+    }
+    lo < r.len() && r[lo].0 <= c
 }\n
 """)
 
+def emit_bool_trie_lookup(f):
+    f.write("""pub struct BoolTrie {
+    // BMP codepoints, as 512-codepoint bitmap blocks of 64 bytes each
+    bmp_index: [u8; 128],
+    bmp_blocks: &'static [u8],
+    // codepoints above the BMP
+    astral: &'static [(char, char)],
+}
+
+#[inline]
+fn trie_range_table(c: char, r: &'static BoolTrie) -> bool {
+    let cp = c as usize;
+    if cp < 0x10000 {
+        let block = r.bmp_index[cp >> 9] as usize;
+        (r.bmp_blocks[(block << 6) | ((cp >> 3) & 63)] >> (cp & 7)) & 1 != 0
+    } else {
+        bsearch_range_table(c, r.astral)
+    }
+}\n
+""")
+
+# split a range table into a deduplicated BMP bitmap trie and astral ranges
+def compute_bool_trie(t_data):
+    bitmap = [0] * 0x2000
+    astral = []
+    for (lo, hi) in t_data:
+        for cp in range(lo, min(hi, 0xffff) + 1):
+            bitmap[cp >> 3] |= 1 << (cp & 7)
+        if hi > 0xffff:
+            astral.append((max(lo, 0x10000), hi))
+    index = []
+    blocks = []
+    block_ids = {}
+    for i in range(0, len(bitmap), 64):
+        block = tuple(bitmap[i:i+64])
+        if block not in block_ids:
+            block_ids[block] = len(blocks)
+            blocks.append(block)
+        index.append(block_ids[block])
+    return (index, blocks, astral)
+
+def emit_bool_trie(f, name, t_data, is_pub=True):
+    (index, blocks, astral) = compute_bool_trie(t_data)
+    pub_string = ""
+    if is_pub:
+        pub_string = "pub "
+    f.write("    %sconst %s: &'static super::BoolTrie = &super::BoolTrie {\n" % (pub_string, name))
+    f.write("        bmp_index: [\n")
+    format_table_content(f, ",".join(str(i) for i in index), 12)
+    f.write("\n        ],\n")
+    f.write("        bmp_blocks: &[\n")
+    data = ",".join("0x%02x" % b for block in blocks for b in block)
+    format_table_content(f, data, 12)
+    f.write("\n        ],\n")
+    if astral:
+        f.write("        astral: &[\n")
+        data = ",".join("(%s,%s)" % (escape_char(lo), escape_char(hi)) for (lo, hi) in astral)
+        format_table_content(f, data, 12)
+        f.write("\n        ],\n")
+    else:
+        f.write("        astral: &[],\n")
+    f.write("    };\n\n")
+
 def emit_table(f, name, t_data, t_type = "&'static [(char, char)]", is_pub=True,
         pfun=lambda x: "(%s,%s)" % (escape_char(x[0]), escape_char(x[1]))):
     pub_string = ""
     if is_pub:
         pub_string = "pub "
     f.write("    %sconst %s: %s = &[\n" % (pub_string, name, t_type))
-    data = ""
-    first = True
-    for dat in t_data:
-        if not first:
-            data += ","
-        first = False
-        data += pfun(dat)
+    data = ",".join(pfun(dat) for dat in t_data)
     format_table_content(f, data, 8)
     f.write("\n    ];\n\n")
 
+# properties with at most this many ranges are emitted as comparison trees
+bst_max_ranges = 16
+
+def emit_bst(f, ranges, indent):
+    pad = " " * indent
+    if not ranges:
+        f.write("%sfalse\n" % pad)
+        return
+    mid = len(ranges) // 2
+    (lo, hi) = ranges[mid]
+    if lo > 0:
+        f.write("%sif c < 0x%x {\n" % (pad, lo))
+        emit_bst(f, ranges[:mid], indent + 4)
+        f.write("%s} else if c <= 0x%x {\n" % (pad, hi))
+    else:
+        f.write("%sif c <= 0x%x {\n" % (pad, hi))
+    f.write("%s    true\n" % pad)
+    f.write("%s} else {\n" % pad)
+    emit_bst(f, ranges[mid+1:], indent + 4)
+    f.write("%s}\n" % pad)
+
+def emit_bst_predicate(f, name, ranges):
+    f.write("    #[inline]\n")
+    f.write("    pub fn %s(c: char) -> bool {\n" % name)
+    f.write("        let c = c as u32;\n")
+    emit_bst(f, ranges, 8)
+    f.write("    }\n\n")
+
 def emit_property_module(f, mod, tbl, emit):
     f.write("pub mod %s {\n" % mod)
     for cat in sorted(emit):
-        emit_table(f, "%s_table" % cat, tbl[cat])
+        if len(tbl[cat]) <= bst_max_ranges:
+            emit_bst_predicate(f, cat, tbl[cat])
+            continue
+        emit_bool_trie(f, "%s_table" % cat, tbl[cat])
+        f.write("    #[inline]\n")
         f.write("    pub fn %s(c: char) -> bool {\n" % cat)
-        f.write("        super::bsearch_range_table(c, %s_table)\n" % cat)
+        f.write("        super::trie_range_table(c, %s_table)\n" % cat)
         f.write("    }\n\n")
     f.write("}\n\n")
 
+def flush_delta_run(run, runs, special):
+    if run is None:
+        return
+    (lo, hi, delta, stride) = run
+    if lo == hi:
+        special.append((lo, (lo + delta, 0, 0)))
+    else:
+        runs.append(run)
+
+# split a case table into runs of single-char mappings that share a delta
+# and a stride of 1 or 2, and the remaining entries.
+#
+# A flat delta array indexed through overlapping fixed-size chunks gives
+# O(1) lookups instead, but the deltas need 32 bits and the chunk index has
+# to span the whole cased range, so for every chunk size from 4 to 128 it
+# comes out around ten times larger than these ~90 runs.
+def compute_delta_runs(table):
+    runs = []
+    special = []
+    run = None
+    for (code, mapped) in sorted(table.items(), key=operator.itemgetter(0)):
+        if mapped[1] == 0 and mapped[2] == 0:
+            delta = mapped[0] - code
+            if run is not None and run[2] == delta:
+                (lo, hi, _, stride) = run
+                if (lo == hi and code - hi <= 2) or code - hi == stride:
+                    run = (lo, code, delta, code - hi)
+                    continue
+            flush_delta_run(run, runs, special)
+            run = (code, code, delta, 1)
+        else:
+            flush_delta_run(run, runs, special)
+            run = None
+            special.append((code, mapped))
+    flush_delta_run(run, runs, special)
+    return (runs, special)
+
 def emit_conversions_module(f, to_upper, to_lower, to_title):
+    f.write("""// each run maps every stride-th char from lo to hi by adding delta
+#[inline]
+fn bsearch_delta_runs(c: char, runs: &'static [(char, char, i32, u8)]) -> Option<char> {
+    // find the first run that does not end before c
+    let mut lo = 0;
+    let mut hi = runs.len();
+    while lo < hi {
+        let m = lo + (hi - lo) / 2;
+        let before = runs[m].1 < c;
+        lo = if before { m + 1 } else { lo };
+        hi = if before { hi } else { m };
+    }
+    if lo == runs.len() {
+        return None;
+    }
+    let (start, _, delta, stride) = runs[lo];
+    if start <= c && (c as u32 - start as u32) % stride as u32 == 0 {
+        char::from_u32((c as i32 + delta) as u32)
+    } else {
+        None
+    }
+}
+
+#[inline]
+fn bsearch_case_table(c: char, table: &'static [(char, [char; 3])]) -> Option<usize> {
+    // find the first key that is not below c
+    let mut lo = 0;
+    let mut hi = table.len();
+    while lo < hi {
+        let m = lo + (hi - lo) / 2;
+        let below = table[m].0 < c;
+        lo = if below { m + 1 } else { lo };
+        hi = if below { hi } else { m };
+    }
+    if lo < table.len() && table[lo].0 == c { Some(lo) } else { None }
+}
+
+""")
     f.write("pub mod conversions {")
     f.write("""
-    use core::cmp::Ordering::{Equal, Less, Greater};
-    use core::slice::SliceExt;
-    use core::option::Option;
     use core::option::Option::{Some, None};
-    use core::result::Result::{Ok, Err};
 
+    #[inline]
     pub fn to_lower(c: char) -> [char; 3] {
-        match bsearch_case_table(c, to_lowercase_table) {
+        if let Some(mapped) = super::bsearch_delta_runs(c, to_lowercase_runs) {
+            return [mapped, '\\0', '\\0'];
+        }
+        match super::bsearch_case_table(c, to_lowercase_table) {
           None        => [c, '\\0', '\\0'],
           Some(index) => to_lowercase_table[index].1
         }
     }
 
+    #[inline]
     pub fn to_upper(c: char) -> [char; 3] {
-        match bsearch_case_table(c, to_uppercase_table) {
+        if let Some(mapped) = super::bsearch_delta_runs(c, to_uppercase_runs) {
+            return [mapped, '\\0', '\\0'];
+        }
+        match super::bsearch_case_table(c, to_uppercase_table) {
             None        => [c, '\\0', '\\0'],
             Some(index) => to_uppercase_table[index].1
         }
     }
 
-    fn bsearch_case_table(c: char, table: &'static [(char, [char; 3])]) -> Option<usize> {
-        match table.binary_search_by(|&(key, _)| {
-            if c == key { Equal }
-            else if key < c { Less }
-            else { Greater }
-        }) {
-            Ok(i) => Some(i),
-            Err(_) => None,
-        }
-    }
-
 """)
+    r_type = "&'static [(char, char, i32, u8)]"
+    rfun = lambda x: "(%s,%s,%d,%d)" % (escape_char(x[0]), escape_char(x[1]), x[2], x[3])
     t_type = "&'static [(char, [char; 3])]"
     pfun = lambda x: "(%s,[%s,%s,%s])" % (
         escape_char(x[0]), escape_char(x[1][0]), escape_char(x[1][1]), escape_char(x[1][2]))
-    emit_table(f, "to_lowercase_table",
-        sorted(to_lower.iteritems(), key=operator.itemgetter(0)),
-        is_pub=False, t_type = t_type, pfun=pfun)
-    emit_table(f, "to_uppercase_table",
-        sorted(to_upper.iteritems(), key=operator.itemgetter(0)),
-        is_pub=False, t_type = t_type, pfun=pfun)
+    for (name, table) in ("lowercase", to_lower), ("uppercase", to_upper):
+        (runs, special) = compute_delta_runs(table)
+        emit_table(f, "to_%s_runs" % name, runs,
+            is_pub=False, t_type = r_type, pfun=rfun)
+        emit_table(f, "to_%s_table" % name, special,
+            is_pub=False, t_type = t_type, pfun=pfun)
     f.write("}\n\n")
 
 def emit_charwidth_module(f, width_table):
+    f.write("""#[inline]
+fn bsearch_range_value_table(c: char, is_cjk: bool, r: &'static [(char, char)],
+                             values: &'static [u8]) -> u8 {
+    // find the first range that does not end before c
+    let mut lo = 0;
+    let mut hi = r.len();
+    while lo < hi {
+        let m = lo + (hi - lo) / 2;
+        let before = r[m].1 < c;
+        lo = if before { m + 1 } else { lo };
+        hi = if before { hi } else { m };
+    }
+    if lo < r.len() && r[lo].0 <= c {
+        // the cjk width is in the high nibble, the non-cjk width in the low one
+        let widths = values[lo];
+        if is_cjk { widths >> 4 } else { widths & 0xF }
+    } else {
+        1
+    }
+}
+
+""")
     f.write("pub mod charwidth {\n")
     f.write("    use core::option::Option;\n")
     f.write("    use core::option::Option::{Some, None};\n")
-    f.write("    use core::slice::SliceExt;\n")
-    f.write("    use core::result::Result::{Ok, Err};\n")
-    f.write("""
-    fn bsearch_range_value_table(c: char, is_cjk: bool, r: &'static [(char, char, u8, u8)]) -> u8 {
-        use core::cmp::Ordering::{Equal, Less, Greater};
-        match r.binary_search_by(|&(lo, hi, _, _)| {
-            if lo <= c && c <= hi { Equal }
-            else if hi < c { Less }
-            else { Greater }
-        }) {
-            Ok(idx) => {
-                let (_, _, r_ncjk, r_cjk) = r[idx];
-                if is_cjk { r_cjk } else { r_ncjk }
-            }
-            Err(_) => 1
-        }
-    }
-""")
-
     f.write("""
+    #[inline]
     pub fn width(c: char, is_cjk: bool) -> Option<usize> {
         match c as usize {
             _c @ 0 => Some(0),          // null is zero width
             cu if cu < 0x20 => None,    // control sequences have no width
             cu if cu < 0x7F => Some(1), // ASCII
             cu if cu < 0xA0 => None,    // more control sequences
-            _ => Some(bsearch_range_value_table(c, is_cjk, charwidth_table) as usize)
+            _ => Some(super::bsearch_range_value_table(c, is_cjk, charwidth_table,
+                                                       charwidth_values) as usize)
         }
     }
 
@@ -438,64 +627,64 @@ def emit_charwidth_module(f, width_table):
 
     f.write("    // character width table. Based on Markus Kuhn's free wcwidth() implementation,\n")
     f.write("    //     http://www.cl.cam.ac.uk/~mgk25/ucs/wcwidth.c\n")
-    emit_table(f, "charwidth_table", width_table, "&'static [(char, char, u8, u8)]", is_pub=False,
-            pfun=lambda x: "(%s,%s,%s,%s)" % (escape_char(x[0]), escape_char(x[1]), x[2], x[3]))
+    for (_, _, width, width_cjk) in width_table:
+        assert 0 <= width < 16 and 0 <= width_cjk < 16, "widths must fit in a nibble"
+    emit_table(f, "charwidth_table", width_table, is_pub=False)
+    # the packed widths of each range above, kept apart to avoid padding the ranges
+    emit_table(f, "charwidth_values", width_table, "&'static [u8]", is_pub=False,
+            pfun=lambda x: "0x%x" % (x[3] << 4 | x[2]))
     f.write("}\n\n")
 
 def emit_norm_module(f, canon, compat, combine, norm_props):
-    canon_keys = canon.keys()
-    canon_keys.sort()
+    canon_keys = sorted(canon)
 
-    compat_keys = compat.keys()
-    compat_keys.sort()
+    compat_keys = sorted(compat)
 
-    canon_comp = {}
-    comp_exclusions = norm_props["Full_Composition_Exclusion"]
+    canon_comp = defaultdict(list)
+    # the exclusions are sorted, disjoint ranges, so flatten them into
+    # half-open bounds: a char is excluded iff it lands after an odd number
+    comp_exclusions = []
+    for (lo, hi) in norm_props["Full_Composition_Exclusion"]:
+        comp_exclusions.extend((lo, hi + 1))
     for char in canon_keys:
-        if True in map(lambda (lo, hi): lo <= char <= hi, comp_exclusions):
+        if bisect.bisect_right(comp_exclusions, char) % 2 == 1:
             continue
         decomp = canon[char]
         if len(decomp) == 2:
-            if not canon_comp.has_key(decomp[0]):
-                canon_comp[decomp[0]] = []
             canon_comp[decomp[0]].append( (decomp[1], char) )
-    canon_comp_keys = canon_comp.keys()
-    canon_comp_keys.sort()
+    canon_comp_keys = sorted(canon_comp)
 
 def remove_from_wtable(wtable, val):
     wtable_out = []
-    while wtable:
-        if wtable[0][1] < val:
-            wtable_out.append(wtable.pop(0))
-        elif wtable[0][0] > val:
+    for (i, entry) in enumerate(wtable):
+        (wt_lo, wt_hi, width, width_cjk) = entry
+        if wt_hi < val:
+            wtable_out.append(entry)
+        elif wt_lo > val:
+            wtable_out.extend(wtable[i:])
             break
+        elif wt_lo == wt_hi == val:
+            continue
+        elif wt_lo == val:
+            wtable_out.append((wt_lo+1, wt_hi, width, width_cjk))
+        elif wt_hi == val:
+            wtable_out.append((wt_lo, wt_hi-1, width, width_cjk))
         else:
-            (wt_lo, wt_hi, width, width_cjk) = wtable.pop(0)
-            if wt_lo == wt_hi == val:
-                continue
-            elif wt_lo == val:
-                wtable_out.append((wt_lo+1, wt_hi, width, width_cjk))
-            elif wt_hi == val:
-                wtable_out.append((wt_lo, wt_hi-1, width, width_cjk))
-            else:
-                wtable_out.append((wt_lo, val-1, width, width_cjk))
-                wtable_out.append((val+1, wt_hi, width, width_cjk))
-    if wtable:
-        wtable_out.extend(wtable)
+            wtable_out.append((wt_lo, val-1, width, width_cjk))
+            wtable_out.append((val+1, wt_hi, width, width_cjk))
     return wtable_out
 
 
 
 def optimize_width_table(wtable):
     wtable_out = []
-    w_this = wtable.pop(0)
-    while wtable:
-        if w_this[1] == wtable[0][0] - 1 and w_this[2:3] == wtable[0][2:3]:
-            w_tmp = wtable.pop(0)
-            w_this = (w_this[0], w_tmp[1], w_tmp[2], w_tmp[3])
+    w_this = wtable[0]
+    for w_next in wtable[1:]:
+        if w_this[1] == w_next[0] - 1 and w_this[2:3] == w_next[2:3]:
+            w_this = (w_this[0], w_next[1], w_next[2], w_next[3])
         else:
             wtable_out.append(w_this)
-            w_this = wtable.pop(0)
+            w_this = w_next
     wtable_out.append(w_this)
     return wtable_out
 
@@ -507,7 +696,14 @@ if __name__ == "__main__":
         # write the file's preamble
         rf.write(preamble)
 
-        # download and parse all the data
+        # download all the data in parallel, then parse it
+        unicode_files = ["ReadMe.txt", "UnicodeData.txt", "SpecialCasing.txt",
+                         "DerivedCoreProperties.txt", "Scripts.txt", "PropList.txt",
+                         "DerivedNormalizationProps.txt"]
+        pool = ThreadPool(len(unicode_files))
+        pool.map(download, unicode_files)
+        pool.close()
+
         fetch("ReadMe.txt")
         with open("ReadMe.txt") as readme:
             pattern = "for Version (\d+)\.(\d+)\.(\d+) of the Unicode"
@@ -529,8 +725,9 @@ pub const UNICODE_VERSION: (u64, u64, u64) = (%s, %s, %s);
         norm_props = load_properties("DerivedNormalizationProps.txt",
                      ["Full_Composition_Exclusion"])
 
-        # bsearch_range_table is used in all the property modules below
+        # the shared lookup helpers, used by all the modules below
         emit_bsearch_range_table(rf)
+        emit_bool_trie_lookup(rf)
 
         # category tables
         for (name, cat, pfuns) in ("general_category", gencats, ["N", "Cc"]), \